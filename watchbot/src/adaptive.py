@@ -0,0 +1,241 @@
+import logging
+import math
+import time
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+import httpx
+from telegram.error import TimedOut
+from telegram.request import HTTPXRequest, RequestData
+from scheduler import FairRateLimiter
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Timeouts:
+    connect: float
+    read: float
+    write: float
+    media_write: float
+    pool: float
+
+    def scale(self, factor: float) -> "Timeouts":
+        return Timeouts(
+            connect=round(self.connect * factor, 1),
+            read=round(self.read * factor, 1),
+            write=round(self.write * factor, 1),
+            media_write=round(self.media_write * factor, 1),
+            pool=round(self.pool * factor, 1),
+        )
+
+
+class AdaptiveController:
+    """
+    Tune timeouts, connection pool size and request rate from observed Bot API latencies.
+
+    Latency is tracked with an EWMA of the round trip time and of its deviation (as TCP does for its
+    retransmission timeout). Timeouts follow `srtt + 4 * rttvar`, never below the configured base values,
+    and are multiplied by a backoff which doubles on every timeout and decays on every success.
+    The request rate follows additive increase / multiplicative decrease,
+    and the pool size follows the peak concurrency observed in the last window.
+
+    Attributes:
+    base (Timeouts): The timeouts used on a healthy network, also the lower bound.
+    backoff (float): Multiplier applied to the timeouts, 1.0 once the network has recovered.
+    rate (float): The current overall request rate (requests per second) of the rate limiter.
+    pool_size (int): The current connection pool size.
+    """
+
+    ALPHA = 1 / 8
+    BETA = 1 / 4
+
+    def __init__(
+        self,
+        base: Timeouts,
+        max_factor: float = 10.0,
+        max_rate: float = 10.0,
+        min_rate: float = 1.0,
+        min_pool_size: int = 256,
+        max_pool_size: int = 1024,
+        decay: float = 0.9,
+        window: int = 50,
+    ):
+        """
+        Initializes a new instance of the AdaptiveController class.
+
+        Args:
+        base (Timeouts): The timeouts used on a healthy network, also the lower bound.
+        max_factor (float, optional): Upper bound of the timeouts relative to `base`. Defaults to 10.
+        max_rate (float, optional): Upper bound of the request rate (requests per second). Defaults to 10.
+        min_rate (float, optional): Lower bound of the request rate (requests per second). Defaults to 1.
+        min_pool_size (int, optional): Lower bound of the connection pool size. Defaults to 256, as `ApplicationBuilder`.
+        max_pool_size (int, optional): Upper bound of the connection pool size. Defaults to 1024.
+        decay (float, optional): Factor applied to the backoff after every success. Defaults to 0.9.
+        window (int, optional): Number of requests between pool size adjustments. Defaults to 50.
+        """
+        self.base = base
+        self.max_factor = max_factor
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.min_pool_size = min_pool_size
+        self.max_pool_size = max_pool_size
+        self.decay = decay
+        self.window = window
+
+        self.srtt: Optional[float] = None
+        self.rttvar: float = 0.0
+        self.backoff: float = 1.0
+        self.rate: float = max_rate
+        self.pool_size: int = min_pool_size
+        self.inflight: int = 0
+        self._peak_inflight: int = 0
+        self._count: int = 0
+        self._rate_limiter: Optional[FairRateLimiter] = None
+
+    def bind(self, rate_limiter: FairRateLimiter) -> None:
+        """Apply the current rate to `rate_limiter` and keep it in sync from now on."""
+        self._rate_limiter = rate_limiter
+        rate_limiter.set_overall_rate(self.rate)
+
+    @property
+    def factor(self) -> float:
+        """Current timeouts relative to `base`."""
+        factor = 1.0
+        if self.srtt is not None:
+            factor = max(factor, (self.srtt + 4 * self.rttvar) / self.base.read)
+        return min(factor * self.backoff, self.max_factor)
+
+    def timeouts(self) -> Timeouts:
+        return self.base.scale(self.factor)
+
+    def retry_delay(self, base: float = 5.0, _max: float = 60.0) -> float:
+        """Delay before retrying after the application failed to start. (seconds)"""
+        return round(min(base * self.backoff, _max), 1)
+
+    def started(self) -> None:
+        self.inflight += 1
+        self._peak_inflight = max(self._peak_inflight, self.inflight)
+
+    def finished(self) -> None:
+        self.inflight -= 1
+
+    def record_latency(self, latency: float) -> None:
+        """Feed the latency of a successful request. (seconds)"""
+        if self.srtt is None:
+            self.srtt, self.rttvar = latency, latency / 2
+        else:
+            self.rttvar = (1 - self.BETA) * self.rttvar + self.BETA * abs(self.srtt - latency)
+            self.srtt = (1 - self.ALPHA) * self.srtt + self.ALPHA * latency
+        self.backoff = max(1.0, self.backoff * self.decay)
+        self._set_rate(self.rate + 0.5)
+        self._tick()
+
+    def record_timeout(self) -> None:
+        self.backoff = min(self.backoff * 2, self.max_factor)
+        self._set_rate(self.rate / 2)
+        self._tick()
+        logger.warning(f"Bot API timed out, timeouts scaled by {self.factor:.1f}, rate {self.rate:.1f}/s")
+
+    def record_throttle(self) -> None:
+        """Feed a `429 Too Many Requests` response."""
+        self._set_rate(self.rate / 2)
+        self._tick()
+
+    def record_pool_timeout(self) -> None:
+        self.pool_size = min(self.pool_size * 2, self.max_pool_size)
+        self._count, self._peak_inflight = 0, self.inflight
+
+    def _set_rate(self, rate: float) -> None:
+        rate = min(max(rate, self.min_rate), self.max_rate)
+        if self._rate_limiter and math.floor(rate) != math.floor(self.rate):
+            self._rate_limiter.set_overall_rate(rate)
+        self.rate = rate
+
+    def _tick(self) -> None:
+        self._count += 1
+        if self._count < self.window:
+            return
+        # Follow the peak concurrency of the last window, shrinking back once the load is gone
+        self.pool_size = min(max(self._peak_inflight + 2, self.min_pool_size), self.max_pool_size)
+        self._count, self._peak_inflight = 0, self.inflight
+
+
+class AdaptiveHTTPXRequest(HTTPXRequest):
+    """
+    HTTPXRequest which reports every Bot API call to an AdaptiveController
+    and applies its timeouts and connection pool size.
+
+    Notes:
+    The connection pool is resized by swapping the HTTPX client, which only happens while no request is in flight.
+    """
+
+    def __init__(self, controller: AdaptiveController, **kwargs):
+        timeouts = controller.timeouts()
+        super().__init__(
+            connection_pool_size=controller.pool_size,
+            connect_timeout=timeouts.connect,
+            read_timeout=timeouts.read,
+            write_timeout=timeouts.write,
+            media_write_timeout=timeouts.media_write,
+            pool_timeout=timeouts.pool,
+            **kwargs,
+        )
+        self.controller = controller
+        self._pool_size = controller.pool_size
+
+    async def do_request(
+        self,
+        url: str,
+        method: str,
+        request_data: Optional[RequestData] = None,
+        read_timeout=HTTPXRequest.DEFAULT_NONE,
+        write_timeout=HTTPXRequest.DEFAULT_NONE,
+        connect_timeout=HTTPXRequest.DEFAULT_NONE,
+        pool_timeout=HTTPXRequest.DEFAULT_NONE,
+    ) -> Tuple[int, bytes]:
+        timeouts = self.controller.timeouts()
+        if read_timeout is self.DEFAULT_NONE:
+            read_timeout = timeouts.read
+        if write_timeout is self.DEFAULT_NONE:
+            write_timeout = timeouts.media_write if request_data and request_data.contains_files else timeouts.write
+        if connect_timeout is self.DEFAULT_NONE:
+            connect_timeout = timeouts.connect
+        if pool_timeout is self.DEFAULT_NONE:
+            pool_timeout = timeouts.pool
+
+        self.controller.started()
+        start = time.monotonic()
+        try:
+            code, payload = await super().do_request(
+                url, method, request_data, read_timeout, write_timeout, connect_timeout, pool_timeout
+            )
+            latency = time.monotonic() - start
+        except TimedOut as timed_out:
+            if isinstance(timed_out.__cause__, httpx.PoolTimeout):
+                self.controller.record_pool_timeout()
+            else:
+                self.controller.record_timeout()
+            raise
+        finally:
+            self.controller.finished()
+        if code == 429:
+            self.controller.record_throttle()
+        elif not (request_data and request_data.contains_files):
+            # Uploads are bound by bandwidth rather than latency
+            self.controller.record_latency(latency)
+        await self._resize()
+        return code, payload
+
+    async def _resize(self) -> None:
+        if self.controller.inflight or self._pool_size == self.controller.pool_size or self._client.is_closed:
+            return
+        self._pool_size = self.controller.pool_size
+        self._client_kwargs["limits"] = httpx.Limits(
+            max_connections=self._pool_size, max_keepalive_connections=self._pool_size
+        )
+        client, self._client = self._client, self._build_client()
+        logger.info(f"Connection pool resized to {self._pool_size}")
+        await client.aclose()
+
+# END
@@ -0,0 +1,80 @@
+"""
+Startup-time benchmark.
+
+Reports the import latency of the bot process, measured in fresh interpreters,
+and the startup stages (imports, ready, first update) logged by `main.py` on every start.
+
+Usage:
+python3 src/benchmark.py [--runs 10] [--log /file/spy.log]
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+SRC = os.path.dirname(os.path.abspath(__file__))
+
+# Modules imported by `main.py` before the first update, and the export-only code loaded on the first /export
+STARTUP_MODULES = ["telegram.ext", "myfunction", "adaptive", "scheduler"]
+EXPORT_MODULES = ["export"]
+
+
+def measure_import(modules: list[str], preloaded: list[str], runs: int) -> list[float]:
+    """Import `modules` in `runs` fresh interpreters, after `preloaded`, and return the latencies. (seconds)"""
+    code = (
+        "import time, importlib\n"
+        f"for m in {preloaded!r}: importlib.import_module(m)\n"
+        "t = time.perf_counter()\n"
+        f"for m in {modules!r}: importlib.import_module(m)\n"
+        "print(time.perf_counter() - t)\n"
+    )
+    latencies = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", code], cwd=SRC, check=True, capture_output=True, text=True
+        ).stdout
+        latencies.append(float(output.strip().splitlines()[-1]))
+    return latencies
+
+
+def parse_startup_log(log_path: str) -> dict[str, list[float]]:
+    """Collect the startup stages logged by `main.py`. (milliseconds)"""
+    stages: dict[str, list[float]] = {}
+    if not os.path.exists(log_path):
+        return stages
+    with open(log_path, encoding="utf-8") as log:
+        for line in log:
+            if " - Startup: " not in line:
+                continue
+            for stage, ms in re.findall(r"(\w+) (\d+) ms", line.split(" - Startup: ", 1)[1]):
+                stages.setdefault(stage, []).append(float(ms))
+    return stages
+
+
+def summary(values: list[float]) -> str:
+    return f"median {statistics.median(values):.0f} ms, min {min(values):.0f} ms, max {max(values):.0f} ms (n={len(values)})"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--log", default="/file/spy.log")
+    args = parser.parse_args()
+
+    startup = measure_import(STARTUP_MODULES, [], args.runs)
+    print(f"import (startup path): {summary([s * 1000 for s in startup])}")
+    if os.getenv("MASTER_TLG_ID"):
+        export = measure_import(EXPORT_MODULES, STARTUP_MODULES, args.runs)
+        print(f"import (export, deferred to first /export): {summary([s * 1000 for s in export])}")
+    else:
+        print("import (export): skipped, MASTER_TLG_ID is not set")
+
+    stages = parse_startup_log(args.log)
+    if not stages:
+        print(f"first update: no startup recorded in {args.log}")
+    for stage, values in stages.items():
+        print(f"{stage} (logged): {summary(values)}")
+
+# END
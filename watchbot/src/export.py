@@ -0,0 +1,334 @@
+import asyncio
+import logging
+import os
+from time import time
+import telegram
+from telegram import Update
+from telegram.ext import Application, CallbackContext
+from telegram.constants import ParseMode
+from typing import Dict, Tuple
+from storage import SQLite3_Storage
+from model import CompactMessage, ExportCheckpoint
+from scheduler import Priority
+from sink import ChallengeSink
+from myfunction import extract_media, journal
+
+logger = logging.getLogger(__name__)
+master = os.getenv("MASTER_TLG_ID", 0)
+assert master != 0
+sink = ChallengeSink(os.getenv("SINK_TLG_IDS", str(master)).split(","), "/file/sink.db")
+
+
+async def export_handler(update: Update, context: CallbackContext) -> None:
+    """
+    Export chat history in csv format.
+
+    Retrieve chat history from the specified chat through `forward_message`.
+    Can choose to export only recent messages or all messages.
+    Due to the limitation of Telegram API, the bot will not be notified when a message is deleted.
+    Therefore, this program iteratively challenges the existence of a message.
+
+    Along this time, the program will also try to retrieve previously uncought messages either due to bot downtime or lost of .db file.
+
+    This function retrieves the chat history from a specified chat using `forward_message` method.
+    It allows the user to export either only recent messages or the entire chat history.
+    Due to Telegram API limitations, the bot cannot detect when a message is deleted directly;
+    thus, the program iteratively checks the existence of each message to handle deletions.
+
+    Additionally, this function attempts to retrieve any messages that were missed,
+    potentially due to bot downtime or the loss of the database file.
+
+    Limitations:
+    - When forwarding messages, the Telegram API changes `msg.chat` to represent the bot
+      and `msg.from_user` to represent the bot's user, masking the original sender's identity.
+    - In group chats, forwarding a message does not capture the identity of the user who forwarded it;
+      instead, it displays the original sender and the bot.
+
+    Side Effects:
+    - This function forward messages to the challenge sink chats to verify their existence,
+      the forwarded messages are deleted in batches afterwards.
+    - It stores chat messages in an SQLite database for persistent storage.
+    - It checkpoints its progress in the journal, an interrupted export resumes from the last checkpoint.
+
+    Note:
+    - This function challenges the existence of messages by attempting to forward them.
+    - It may mark messages as deleted if the forwarding fails.
+    """
+    # Configuration
+    recent: bool = False
+
+    chatid = update.message.chat.id
+    messageid = update.message.message_id
+    running = running_exports(context.application).get(chatid)
+    if running and not running[1].done():
+        # Extend the running sweep up to this request and wait for its export
+        checkpoint, task = running
+        checkpoint.search_to = max(checkpoint.search_to, messageid)
+        journal.save_checkpoint(checkpoint)
+        await asyncio.shield(task)
+        return None
+
+    checkpoint = journal.load_checkpoint(chatid)
+    if checkpoint:
+        # Resume the unfinished sweep and extend it up to this request
+        logger.info(f"Resume export of {chatid} from message {checkpoint.next_id}")
+        checkpoint.search_to = max(checkpoint.search_to, messageid)
+    else:
+        # Determine search range
+        if recent:
+            search_from = messageid - 20
+        else:
+            search_from = 0
+        checkpoint = ExportCheckpoint(
+            chatid=chatid,
+            chattype=update.message.chat.type,
+            chatname=update.message.chat.title or (
+                f"{update.message.chat.first_name} {update.message.chat.last_name}"
+            ),
+            chattitle=update.message.chat.title,
+            caller_name=(
+                    update.message.from_user.username
+                    or f"{update.message.from_user.first_name} {update.message.from_user.last_name}"
+            ),
+            search_from=search_from,
+            search_to=messageid,
+            next_id=search_from,
+        )
+    journal.save_checkpoint(checkpoint)
+    await asyncio.shield(
+        start_export(context.application, checkpoint, Priority.BULK, Priority.INTERACTIVE)
+    )
+
+
+def running_exports(application: Application) -> Dict[int, Tuple[ExportCheckpoint, asyncio.Task]]:
+    """The export running for each chat, at most one per chat."""
+    return application.bot_data.setdefault("running_exports", {})
+
+
+def start_export(
+    application: Application, checkpoint: ExportCheckpoint, sweep_priority: Priority, delivery_priority: Priority
+) -> asyncio.Task:
+    """
+    Run the sweep of `checkpoint` and send its export, registered so that no other sweep of the chat starts meanwhile.
+
+    Args:
+    - application (Application): The running application.
+    - checkpoint (ExportCheckpoint): The progress of the sweep.
+    - sweep_priority (Priority): Priority class of the forwards challenging the messages.
+    - delivery_priority (Priority): Priority class of the delivery of the export.
+
+    Returns:
+    - asyncio.Task: The task running the export, awaited by the application upon shutdown.
+    """
+    exports = running_exports(application)
+    task = application.create_task(run_export(application, checkpoint, sweep_priority, delivery_priority))
+    exports[checkpoint.chatid] = (checkpoint, task)
+
+    def unregister(_: asyncio.Task) -> None:
+        if exports.get(checkpoint.chatid, (None, None))[1] is task:
+            del exports[checkpoint.chatid]
+
+    task.add_done_callback(unregister)
+    return task
+
+
+async def resume_exports(application: Application) -> None:
+    """
+    Resume every export sweep interrupted by a previous run.
+
+    Waits for the application to start running, so that the sweeps are awaited upon shutdown.
+    """
+    while not application.running:
+        await asyncio.sleep(0.1)
+    # Challenges left behind by an interrupted run
+    await sink.flush(application.bot)
+    for checkpoint in journal.checkpoints():
+        if checkpoint.chatid in running_exports(application):
+            continue
+        logger.info(f"Resume export of {checkpoint.chatid} from message {checkpoint.next_id}")
+        # Reconciliation of work the chat already waited for, ahead of fresh bulk exports
+        start_export(application, checkpoint, Priority.BACKGROUND, Priority.BACKGROUND)
+
+
+async def run_export(
+    application: Application, checkpoint: ExportCheckpoint, sweep_priority: Priority, delivery_priority: Priority
+) -> None:
+    """
+    Sweep the chat and send its export, until the whole requested range is delivered.
+
+    The checkpoint is cleared once delivered, or when the chat can no longer be reached
+    (e.g. the bot was removed from the chat), so that a broken export is not retried on every restart.
+    """
+    try:
+        while True:
+            if not await sweep_chat(application, checkpoint, sweep_priority):
+                return None
+            await send_export(application.bot, checkpoint, delivery_priority)
+            if checkpoint.next_id >= checkpoint.search_to:
+                journal.clear_checkpoint(checkpoint.chatid)
+                return None
+            # A later /export raised `search_to` after the sweep, check the rest and deliver again
+            logger.info(f"Export of {checkpoint.chatid} extended up to message {checkpoint.search_to}")
+    except (telegram.error.Forbidden, telegram.error.BadRequest) as error:
+        if not await is_chat_unreachable(application.bot, checkpoint.chatid, error):
+            raise
+        logger.error(f"Export of {checkpoint.chatid} abandoned, the chat is unreachable: {error}")
+        journal.clear_checkpoint(checkpoint.chatid)
+        await sink.flush(application.bot)
+
+
+def is_chat_not_found(error: telegram.error.TelegramError) -> bool:
+    return isinstance(error, telegram.error.BadRequest) and "chat not found" in error.message.lower()
+
+
+def is_message_not_found(error: telegram.error.TelegramError) -> bool:
+    return isinstance(error, telegram.error.BadRequest) and "message to forward not found" in error.message.lower()
+
+
+async def is_chat_unreachable(bot: telegram.Bot, chatid: int, error: telegram.error.TelegramError) -> bool:
+    """Whether `error` means that the bot lost access to `chatid`, rather than to a sink chat."""
+    if not (isinstance(error, telegram.error.Forbidden) or is_chat_not_found(error)):
+        return False
+    try:
+        await bot.get_chat(chatid)
+    except (telegram.error.Forbidden, telegram.error.BadRequest):
+        return True
+    return False
+
+
+async def sweep_chat(application: Application, checkpoint: ExportCheckpoint, priority: Priority) -> bool:
+    """
+    Challenge the existence of every message from `checkpoint.next_id` to `checkpoint.search_to`.
+
+    Args:
+    - application (Application): The running application.
+    - checkpoint (ExportCheckpoint): The progress of the sweep, saved to the journal after every message.
+    - priority (Priority): Priority class of the forwards challenging the messages.
+
+    Returns:
+    - bool: True if the sweep completed, False if it was interrupted by a shutdown.
+    """
+    # A wrong sink would fail every forward sent to it, fail before challenging any message
+    await sink.verify(application.bot)
+    chatid = checkpoint.chatid
+    storage = SQLite3_Storage(f"/file/{chatid}.db", overwrite=False)
+    # `search_to` may be raised by a later /export while the sweep is running
+    while checkpoint.next_id < checkpoint.search_to:
+        i = checkpoint.next_id
+        if not application.running:
+            # Graceful shutdown, the next run resumes from this message
+            logger.info(f"Export of {chatid} interrupted at message {i}")
+            await sink.flush(application.bot)
+            return False
+        result = None
+        try:
+            key = f"{chatid}/{i}"
+            result = storage.get(key)
+            # Challenge the existence of a message
+            sink_chat = sink.next_chat()
+            msg = await application.bot.forward_message(
+                chat_id=sink_chat,
+                message_id=i,
+                from_chat_id=chatid,
+                disable_notification=True,
+                rate_limit_args=priority,
+            )
+            sink.record(sink_chat, msg.message_id)
+            if result is None:
+                if (
+                        msg.forward_origin.type
+                        is telegram.constants.MessageOriginType.HIDDEN_USER
+                ):
+                    forward_origin: telegram.MessageOriginHiddenUser = msg.forward_origin
+                    forward_sender_name = forward_origin.sender_user_name
+                    is_bot = False
+                else:
+                    forward_origin: telegram.MessageOriginUser = msg.forward_origin
+                    forward_sender_name = (
+                            f"{forward_origin.sender_user.first_name} {forward_origin.sender_user.last_name}"
+                            or forward_origin.sender_user.username
+                    )
+                    is_bot = forward_origin.sender_user.is_bot
+
+                if (
+                        checkpoint.chattype == telegram.constants.ChatType.PRIVATE
+                        and forward_sender_name != checkpoint.caller_name
+                ):
+                    is_forwarded = True
+                else:
+                    is_forwarded = False  # forward_sender_name[-3:].lower() == "bot":
+
+                # Set username and userid as None since we cannot discern it's original sender.
+                # To be honest, we do not know the original created datetime
+                result = CompactMessage(
+                    identifier=key,
+                    text=msg.text or msg.caption,
+                    chattype=checkpoint.chattype,
+                    chatid=chatid,
+                    chatname=checkpoint.chatname,
+                    userid=None,
+                    username=None,
+                    message_id=i,
+                    created=None,
+                    lastUpdated=str(msg.forward_origin.date),
+                    edited=False,
+                    deleted=False,
+                    isForwarded=is_forwarded,
+                    author=forward_sender_name,
+                    isBot=is_bot,
+                    media=extract_media(msg),
+                )
+                storage.set(key, result.to_dict())
+        except telegram.error.BadRequest as bad_request:
+            if is_chat_not_found(bad_request):
+                raise
+            if not is_message_not_found(bad_request):
+                # Only a missing message proves a deletion
+                logger.error(f"Failed to copy message({key}): {bad_request}")
+            elif result:
+                # Message has been deleted
+                result["deleted"] = True
+                storage.set(key, result)
+                logger.error(f"Failed to copy message({key}): {bad_request}")
+            else:
+                logger.error(f"Failed to copy message({key}): {bad_request}")
+        checkpoint.next_id = i + 1
+        journal.save_checkpoint(checkpoint)
+        await sink.flush(application.bot, full_only=True)
+    await sink.flush(application.bot)
+    return True
+
+
+async def send_export(bot: telegram.Bot, checkpoint: ExportCheckpoint, priority: Priority) -> None:
+    """Export the chat database as csv and send it to the chat."""
+    storage = SQLite3_Storage(f"/file/{checkpoint.chatid}.db", overwrite=False)
+    if checkpoint.chattitle:
+        export_path = f"/file/{checkpoint.chattitle}_{int(time())}.csv"
+    else:
+        export_path = f"/file/{checkpoint.chatid}_{int(time())}.csv"
+    storage.export_csv(export_path)
+    reply_msg = await bot.send_document(
+        checkpoint.chatid, export_path, parse_mode=ParseMode.HTML, rate_limit_args=priority
+    )
+    conversation = CompactMessage(
+        identifier=f"{reply_msg.chat.id}/{reply_msg.message_id}",
+        text=None,
+        chattype=reply_msg.chat.type,
+        chatid=reply_msg.chat.id,
+        chatname=reply_msg.chat.title or f"{reply_msg.chat.first_name} {reply_msg.chat.last_name}",
+        userid=reply_msg.from_user.id,
+        username=reply_msg.from_user.username,
+        message_id=reply_msg.message_id,
+        created=str(reply_msg.date),
+        lastUpdated=str(reply_msg.date),
+        edited=False,
+        deleted=False,
+        isForwarded=False,
+        author=None,
+        isBot=False,
+        media=extract_media(reply_msg),
+    )
+    storage = SQLite3_Storage(f"/file/{conversation.chatid}.db", overwrite=False)
+    storage.set(conversation.identifier, conversation.to_dict())
+
+# END
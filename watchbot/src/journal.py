@@ -0,0 +1,69 @@
+from typing import Optional
+from storage import SQLite3_Storage
+from model import ExportCheckpoint
+
+
+class Journal:
+    """
+    Durable work journal backed by SQLite3.
+
+    The journal keeps the progress of every `/export` sweep, one record per chat,
+    so that an interrupted sweep survives a crash or a restart of the bot.
+
+    Attributes:
+    db_path (str): The path to the SQLite3 database holding the journal.
+    """
+
+    def __init__(self, db_path: str):
+        """
+        Initializes a new instance of the Journal class.
+
+        Args:
+        db_path (str): The path to the SQLite3 database holding the journal.
+        """
+        self.db_path = db_path
+        self.checkpoint = SQLite3_Storage(db_path, table_name="checkpoint", overwrite=False)
+
+    def save_checkpoint(self, checkpoint: ExportCheckpoint) -> None:
+        """
+        Persist the progress of an export sweep.
+
+        Args:
+        checkpoint (ExportCheckpoint): The progress to persist, keyed by chat id.
+        """
+        self.checkpoint.set(str(checkpoint.chatid), checkpoint.to_dict())
+
+    def load_checkpoint(self, chatid: int) -> Optional[ExportCheckpoint]:
+        """
+        Retrieve the progress of an unfinished export sweep.
+
+        Args:
+        chatid (int): The chat to look up.
+
+        Returns:
+        Optional[ExportCheckpoint]: The saved progress, or None if no export is in progress.
+        """
+        data = self.checkpoint.get(str(chatid))
+        if data is None:
+            return None
+        return ExportCheckpoint(**data)
+
+    def clear_checkpoint(self, chatid: int) -> None:
+        """
+        Forget the progress of an export sweep once it has completed.
+
+        Args:
+        chatid (int): The chat whose export has completed.
+        """
+        self.checkpoint.drop(str(chatid))
+
+    def checkpoints(self) -> list[ExportCheckpoint]:
+        """
+        Returns every unfinished export sweep.
+
+        Returns:
+        list[ExportCheckpoint]: The saved progress of each unfinished export.
+        """
+        return [ExportCheckpoint(**self.checkpoint.get(key)) for key in self.checkpoint.keys()]
+
+# END
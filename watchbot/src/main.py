@@ -1,18 +1,22 @@
+import asyncio
 import logging
-import time
 import os
+import time
 
 import telegram
 from telegram.ext import (
     Application,
     ApplicationBuilder,
+    CallbackContext,
     CommandHandler,
     MessageHandler,
-    AIORateLimiter,
+    TypeHandler,
     filters,
 )
-from typing import Any, Callable, Coroutine, Tuple, Optional
+from typing import Any, Callable, Coroutine
 import myfunction
+from adaptive import AdaptiveController, AdaptiveHTTPXRequest, Timeouts
+from scheduler import FairRateLimiter, Priority
 
 logging.basicConfig(
     filename="/file/spy.log",
@@ -22,9 +26,23 @@ logging.basicConfig(
 )
 
 logger = logging.getLogger(__name__)
+# Imports are CPU-bound, the CPU time spent so far approximates them and dates the start of the process
+startup = {"imports": time.process_time()}
+started = time.perf_counter() - startup["imports"]
+
+
+async def report_first_update(update: telegram.Update, context: CallbackContext) -> None:
+    if "first_update" in startup:
+        return None
+    startup["first_update"] = time.perf_counter() - started
+    logger.info(
+        "Startup: "
+        + ", ".join(f"{stage} {seconds * 1000:.0f} ms" for stage, seconds in startup.items())
+    )
 
 
-def run_bot(bot: Application) -> None:
+def setup(bot: Application) -> None:
+    bot.add_handler(TypeHandler(telegram.Update, report_first_update), group=-1)
     bot.add_handler(MessageHandler(filters.ALL, myfunction.middleware_function), group=0)
     # bot.add_handler(CommandHandler("retrieve_via_forward", myfunction.retrieve_via_forward), group=1)
     # bot.add_handler(CommandHandler("retrieve_via_copy", myfunction.retrieve_via_copy), group=1)
@@ -32,108 +50,67 @@ def run_bot(bot: Application) -> None:
     bot.add_handler(CommandHandler("help", myfunction.help_handler), group=1)
     bot.add_handler(MessageHandler(filters.TEXT, myfunction.message_handler), group=1)
     bot.add_error_handler(myfunction.error_handler)
-    bot.run_polling(poll_interval=0)
+
+
+def run_bot(bot: Application) -> None:
+    bot.run_polling(
+        poll_interval=0,
+        close_loop=False,  # The same loop and application are reused by the next retry
+    )
 
 
 def build(
     token: str,
-    cto: float,
-    rto: float,
-    wto: float,
-    media_wto: float,
-    pto: float,
-    rate_limiter: AIORateLimiter,
+    controller: AdaptiveController,
+    rate_limiter: FairRateLimiter,
     post_init_callback: Callable[[Application], Coroutine[Any, Any, None]],
 ) -> Application:
+    controller.bind(rate_limiter)
     return (
         ApplicationBuilder()
         .token(token)
         .concurrent_updates(True)
-        .connect_timeout(cto)
-        .read_timeout(rto)
-        .write_timeout(wto)
-        .media_write_timeout(media_wto)
-        .pool_timeout(pto)
+        .request(AdaptiveHTTPXRequest(controller))
         .rate_limiter(rate_limiter)
         .post_init(post_init_callback)
         .build()
     )
 
 
-def update_timeout_factor(tf: float, mf: float = 1.2, _max: float = 10) -> float:
-    return round(min(tf * mf, _max), 1)
-
-
-def update_delay(d: float, mf: float = 1.2, _max: float = 60.0) -> float:
-    """Update delay time. (seconds)"""
-    return round(min(d * mf, _max), 1)
-
-
 async def post_init(application: Application) -> None:
-    await application.bot.set_my_commands([("/help", "Help Message")])
-
-
-def update_timeout(
-    factor: float,
-    _connect_timeout: float,
-    _read_timeout: float,
-    _write_timeout: float,
-    _media_write_timeout: float,
-    _pool_timeout: float,
-) -> Tuple[float, float, float, float, float]:
-    return (
-        _connect_timeout * factor,
-        _read_timeout * factor,
-        _write_timeout * factor,
-        _media_write_timeout * factor,
-        _pool_timeout * factor,
+    startup.setdefault("ready", time.perf_counter() - started)
+    await application.bot.set_my_commands(
+        [("/help", "Help Message")], rate_limit_args=Priority.BACKGROUND
     )
+    # Recover export sweeps left unfinished by the previous run,
+    # a task left by a failed start is still waiting for the application to run
+    resume_task = application.bot_data.get("resume_task")
+    if resume_task is None or resume_task.done():
+        application.bot_data["resume_task"] = asyncio.create_task(
+            myfunction.resume_exports(application)
+        )
 
 
 if __name__ == "__main__":
-    connect_timeout, pool_timeout = 5.0, 1.0
-    read_timeout, write_timeout, media_write_timeout = 5.0, 5.0, 20.0
-    timeout_factor = 1.2
-    delay, delay_factor = 5.0, 1.5
+    controller = AdaptiveController(
+        Timeouts(connect=5.0, read=5.0, write=5.0, media_write=20.0, pool=1.0)
+    )
 
     token = os.getenv("TLG_TOKEN")
     max_retry = int(os.getenv("MAX_RETRY", 5))
 
+    # Built once, the application and event loop are reused by every retry. The HTTPX client
+    # is only reused when the start fails in initialize(), a failure after it shuts the client down.
+    rate_limiter = FairRateLimiter(
+        overall_max_rate=10, overall_time_period=1, max_retries=max_retry
+    )
+    application = build(token, controller, rate_limiter, post_init)
+    setup(application)
     while True:
         try:
-            aio_rate_limiter = AIORateLimiter(
-                overall_max_rate=10, overall_time_period=1, max_retries=max_retry
-            )
-            application = build(
-                token,
-                connect_timeout,
-                read_timeout,
-                write_timeout,
-                media_write_timeout,
-                pool_timeout,
-                aio_rate_limiter,
-                post_init,
-            )
             run_bot(application)
             break
         except telegram.error.TimedOut as error:
             logger.error(f"{type(error)}: {str(error)}")  # AttributeError: type object 'TimedOut' has no attribute 'name'
-            # Update timeout
-            timeout_factor = update_timeout_factor(timeout_factor)
-            (
-                connect_timeout,
-                read_timeout,
-                write_timeout,
-                media_write_timeout,
-                pool_timeout,
-            ) = update_timeout(
-                timeout_factor,
-                connect_timeout,
-                read_timeout,
-                write_timeout,
-                media_write_timeout,
-                pool_timeout,
-            )
-            # Update delay
-            delay = update_delay(delay, delay_factor)
-            time.sleep(delay)
+            # Timeouts and rate were already adapted by the controller, only wait for the network
+            time.sleep(controller.retry_delay())
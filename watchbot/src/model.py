@@ -58,5 +58,29 @@ class CompactMessage:
     @property
     def json(self):
         return dumps(self.__dict__, ensure_ascii=False).encode('utf8')
+
+
+@dataclass
+class ExportCheckpoint:
+    """Progress of an `/export` sweep, `next_id` is the first message id not yet challenged."""
+    chatid: int
+    chattype: str
+    chatname: str
+    chattitle: Optional[str]
+    caller_name: str
+    search_from: int
+    search_to: int
+    next_id: int
+
+    def to_dict(self):
+        return self.__dict__
+
+    @property
+    def __dict__(self):
+        return asdict(self)
+
+    @property
+    def json(self):
+        return dumps(self.__dict__, ensure_ascii=False).encode('utf8')
     
 # END
@@ -0,0 +1,261 @@
+import asyncio
+import contextlib
+import logging
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from enum import IntEnum
+from typing import Any, Callable, Coroutine, Deque, Dict, List, Optional, Union
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+logger = logging.getLogger(__name__)
+
+
+class Priority(IntEnum):
+    """Priority class of a request, passed to bot methods through `rate_limit_args`."""
+    INTERACTIVE = 0
+    BACKGROUND = 1
+    BULK = 2
+
+
+class TokenBucket:
+    """
+    Token bucket allowing `max_rate` acquisitions per `time_period`, in bursts of up to `max_rate`.
+
+    Unlike `aiolimiter.AsyncLimiter` it never blocks, the scheduler decides what to wait for.
+    """
+
+    def __init__(self, max_rate: float, time_period: float):
+        self.max_rate = max_rate
+        self.time_period = time_period
+        self._tokens = max_rate
+        self._last_check: Optional[float] = None
+
+    @property
+    def rate_per_sec(self) -> float:
+        return self.max_rate / self.time_period
+
+    def _refill(self, now: float) -> None:
+        if self._last_check is not None:
+            self._tokens = min(self.max_rate, self._tokens + (now - self._last_check) * self.rate_per_sec)
+        self._last_check = now
+
+    def wait_time(self, now: float) -> float:
+        """Seconds until one token is available, 0 if it is available now."""
+        self._refill(now)
+        return max(0.0, (1 - self._tokens) / self.rate_per_sec)
+
+    def consume(self, now: float) -> None:
+        self._refill(now)
+        self._tokens -= 1
+
+    def is_full(self, now: float) -> bool:
+        self._refill(now)
+        return self._tokens >= self.max_rate
+
+
+@dataclass
+class _Job:
+    chat_id: Union[int, str]
+    future: asyncio.Future = field(repr=False)
+
+
+class FairRateLimiter(BaseRateLimiter[Priority]):
+    """
+    Rate limiter scheduling requests by priority class and by chat.
+
+    Requests wait in one FIFO queue per (priority class, fairness key), the fairness key being the chat
+    the request is about (`from_chat_id` for forwards, `chat_id` otherwise).
+    Priority classes are served by smooth weighted round-robin, so bulk work still progresses but cannot
+    starve interactive replies, and the queues within a class are served round-robin.
+    A request is only dispatched once the overall limit and the limits of its target chat allow it:
+    - every chat: `chat_max_rate` per `chat_time_period` (Telegram: 1 message per second).
+    - groups and channels: additionally `group_max_rate` per `group_time_period` (Telegram: 20 messages per minute).
+
+    Requests without a `chat_id` are not queued, as with `AIORateLimiter`.
+
+    Attributes:
+    weights (Dict[Priority, int]): Share of the dispatch slots of each priority class.
+    """
+
+    def __init__(
+        self,
+        overall_max_rate: float = 30,
+        overall_time_period: float = 1,
+        chat_max_rate: float = 1,
+        chat_time_period: float = 1,
+        group_max_rate: float = 20,
+        group_time_period: float = 60,
+        max_retries: int = 0,
+        weights: Optional[Dict[Priority, int]] = None,
+    ) -> None:
+        """
+        Initializes a new instance of the FairRateLimiter class.
+
+        Args:
+        overall_max_rate (float, optional): Requests allowed per `overall_time_period` over all chats. Defaults to 30.
+        overall_time_period (float, optional): Defaults to 1 second.
+        chat_max_rate (float, optional): Requests allowed per `chat_time_period` in a single chat. Defaults to 1.
+        chat_time_period (float, optional): Defaults to 1 second.
+        group_max_rate (float, optional): Requests allowed per `group_time_period` in a group. Defaults to 20.
+        group_time_period (float, optional): Defaults to 60 seconds.
+        max_retries (int, optional): Retries after a `RetryAfter` error. Defaults to 0.
+        weights (Dict[Priority, int], optional): Defaults to 8:3:1 for interactive:background:bulk.
+        """
+        self._overall = TokenBucket(overall_max_rate, overall_time_period)
+        self._chat_max_rate = chat_max_rate
+        self._chat_time_period = chat_time_period
+        self._group_max_rate = group_max_rate
+        self._group_time_period = group_time_period
+        self._max_retries = max_retries
+        self.weights = weights or {Priority.INTERACTIVE: 8, Priority.BACKGROUND: 3, Priority.BULK: 1}
+
+        self._chat_buckets: Dict[Union[int, str], List[TokenBucket]] = {}
+        self._queues: Dict[Priority, "OrderedDict[Union[int, str], Deque[_Job]]"] = {
+            priority: OrderedDict() for priority in Priority
+        }
+        self._current: Dict[Priority, int] = {priority: 0 for priority in Priority}
+        self._wakeup = asyncio.Event()
+        self._retry_after_event = asyncio.Event()
+        self._retry_after_event.set()
+        self._dispatcher: Optional[asyncio.Task] = None
+
+    async def initialize(self) -> None:
+        # The application is reused across retries, a failed start does not call shutdown
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+
+    async def shutdown(self) -> None:
+        if self._dispatcher:
+            self._dispatcher.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._dispatcher
+            self._dispatcher = None
+
+    def set_overall_rate(self, rate: float) -> None:
+        """Change the overall rate (requests per second) while the application is running."""
+        self._overall.max_rate = max(1.0, rate * self._overall.time_period)
+        logger.info(f"Overall rate limit set to {self._overall.max_rate:.0f}/{self._overall.time_period}s")
+        self._wakeup.set()
+
+    def pending(self) -> Dict[Priority, int]:
+        """Number of queued requests per priority class."""
+        return {
+            priority: sum(len(queue) for queue in queues.values())
+            for priority, queues in self._queues.items()
+        }
+
+    def _get_chat_buckets(self, chat_id: Union[int, str], now: float) -> List[TokenBucket]:
+        if len(self._chat_buckets) > 512:
+            for key, buckets in list(self._chat_buckets.items()):
+                if key != chat_id and all(bucket.is_full(now) for bucket in buckets):
+                    del self._chat_buckets[key]
+        if chat_id not in self._chat_buckets:
+            buckets = [TokenBucket(self._chat_max_rate, self._chat_time_period)]
+            if (isinstance(chat_id, int) and chat_id < 0) or isinstance(chat_id, str):
+                buckets.append(TokenBucket(self._group_max_rate, self._group_time_period))
+            self._chat_buckets[chat_id] = buckets
+        return self._chat_buckets[chat_id]
+
+    def _wait_time(self, job: _Job, now: float) -> float:
+        return max(bucket.wait_time(now) for bucket in self._get_chat_buckets(job.chat_id, now))
+
+    def _pick(self, now: float) -> Optional[_Job]:
+        """Pop the next dispatchable job, or return None if none can be dispatched now."""
+        candidates: Dict[Priority, Union[int, str]] = {}
+        for priority, queues in self._queues.items():
+            for key, queue in queues.items():
+                if self._wait_time(queue[0], now) == 0:
+                    candidates[priority] = key
+                    break
+        if not candidates:
+            return None
+        # Smooth weighted round-robin among the classes having a dispatchable job
+        total = sum(self.weights[priority] for priority in candidates)
+        for priority in Priority:
+            if priority in candidates:
+                self._current[priority] += self.weights[priority]
+            else:
+                self._current[priority] = 0
+        priority = max(candidates, key=lambda p: self._current[p])
+        self._current[priority] -= total
+
+        # Round-robin within the class: the served key goes to the back
+        queues = self._queues[priority]
+        queue = queues.pop(candidates[priority])
+        job = queue.popleft()
+        if queue:
+            queues[candidates[priority]] = queue
+        return job
+
+    async def _dispatch(self) -> None:
+        while True:
+            self._wakeup.clear()
+            await self._retry_after_event.wait()
+            loop = asyncio.get_running_loop()
+            now = loop.time()
+            delay = self._overall.wait_time(now)
+            if delay == 0:
+                job = self._pick(now)
+                if job is not None:
+                    if job.future.done():
+                        # The caller was cancelled while queued
+                        continue
+                    self._overall.consume(now)
+                    for bucket in self._get_chat_buckets(job.chat_id, now):
+                        bucket.consume(now)
+                    job.future.set_result(None)
+                    continue
+                heads = [queue[0] for queues in self._queues.values() for queue in queues.values()]
+                delay = min((self._wait_time(job, now) for job in heads), default=None)
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+
+    async def _acquire(self, priority: Priority, key: Union[int, str], chat_id: Union[int, str]) -> None:
+        job = _Job(chat_id=chat_id, future=asyncio.get_running_loop().create_future())
+        self._queues[priority].setdefault(key, deque()).append(job)
+        self._wakeup.set()
+        await job.future
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Union[bool, Dict[str, Any], List[Dict[str, Any]]]]],
+        args: Any,
+        kwargs: Dict[str, Any],
+        endpoint: str,
+        data: Dict[str, Any],
+        rate_limit_args: Optional[Priority],
+    ) -> Union[bool, Dict[str, Any], List[Dict[str, Any]]]:
+        """
+        Processes a request once the scheduler dispatches it.
+
+        Args:
+        rate_limit_args (Optional[Priority]): Priority class of the request. Defaults to `Priority.INTERACTIVE`.
+        """
+        priority = Priority.INTERACTIVE if rate_limit_args is None else rate_limit_args
+        chat_id = data.get("chat_id")
+        with contextlib.suppress(ValueError, TypeError):
+            chat_id = int(chat_id)
+        key = data.get("from_chat_id", chat_id)
+
+        for i in range(self._max_retries + 1):
+            try:
+                if chat_id is None:
+                    await self._retry_after_event.wait()
+                else:
+                    await self._acquire(priority, key, chat_id)
+                return await callback(*args, **kwargs)
+            except RetryAfter as exc:
+                if i == self._max_retries:
+                    logger.exception(f"Rate limit hit after maximum of {self._max_retries} retries", exc_info=exc)
+                    raise exc
+                sleep = exc.retry_after + 0.1
+                logger.info(f"Rate limit hit. Retrying after {sleep} seconds")
+                self._retry_after_event.clear()
+                await asyncio.sleep(sleep)
+            finally:
+                self._retry_after_event.set()
+        return None
+
+# END
@@ -0,0 +1,136 @@
+import logging
+import os
+from time import time
+from typing import Dict, List, Union
+
+import telegram
+from storage import SQLite3_Storage
+from scheduler import Priority
+
+logger = logging.getLogger(__name__)
+
+
+class ChallengeSink:
+    """
+    Managed set of chats receiving the messages forwarded to challenge their existence.
+
+    Forwarded challenges are deleted in batches once verified, so the sink chats do not grow with every export.
+    Challenges rotate across the sink chats to spread the per-chat rate limit.
+
+    Attributes:
+    chats (List[int]): The configured sink chats, used round-robin.
+        Challenges left in sink chats no longer configured are still deleted.
+    metrics (SQLite3_Storage): Usage per sink chat; forwarded, deleted and failed counters,
+        and the challenges still pending deletion with their forward time, so that a restart can clean them up.
+
+    Notes:
+    Telegram accepts at most 100 messages per `delete_messages` call,
+    and only deletes messages sent less than 48 hours ago.
+    """
+
+    BATCH_SIZE = 100
+    DELETE_WINDOW = 48 * 60 * 60
+
+    def __init__(self, chats: List[Union[int, str]], db_path: str):
+        """
+        Initializes a new instance of the ChallengeSink class.
+
+        Args:
+        chats (List[Union[int, str]]): The sink chats, at least one.
+        db_path (str): The path to the SQLite3 database holding the usage metrics.
+        """
+        assert len(chats) > 0
+        self.chats = [int(chat) for chat in chats]
+        self.metrics = SQLite3_Storage(db_path, table_name="sink", overwrite=False)
+        self._next = 0
+        self._verified = False
+        self._usage: Dict[int, dict] = {}
+        for chat in self.chats + [int(key) for key in self.metrics.keys()]:
+            if chat not in self._usage:
+                self._usage[chat] = self.metrics.get(str(chat)) or {
+                    "forwarded": 0, "deleted": 0, "failed": 0, "pending": []
+                }
+
+    @classmethod
+    def has_pending(cls, db_path: str) -> bool:
+        """Whether the sink database at `db_path` holds challenges still pending deletion."""
+        if not os.path.exists(db_path):
+            return False
+        metrics = SQLite3_Storage(db_path, table_name="sink", overwrite=False)
+        return any(metrics.get(key)["pending"] for key in metrics.keys())
+
+    async def verify(self, bot: telegram.Bot) -> None:
+        """
+        Check once that the bot can reach every configured sink chat.
+
+        Raises:
+        ValueError: If a sink chat does not exist or the bot has no access to it.
+        """
+        if self._verified:
+            return None
+        for chat in self.chats:
+            try:
+                await bot.get_chat(chat)
+            except (telegram.error.BadRequest, telegram.error.Forbidden) as error:
+                logger.error(f"Sink chat {chat} is unreachable: {error}")
+                raise ValueError(f"Sink chat {chat} is unreachable, check SINK_TLG_IDS: {error}") from error
+        self._verified = True
+
+    def next_chat(self) -> int:
+        chat = self.chats[self._next % len(self.chats)]
+        self._next += 1
+        return chat
+
+    def record(self, chat: int, message_id: int) -> None:
+        """Register a challenge message forwarded to `chat`, to be deleted by the next flush."""
+        usage = self._usage[chat]
+        usage["forwarded"] += 1
+        usage["pending"].append([message_id, time()])
+        self.metrics.set(str(chat), usage)
+
+    async def flush(self, bot: telegram.Bot, full_only: bool = False) -> None:
+        """
+        Delete the pending challenge messages.
+
+        Args:
+        bot (telegram.Bot): The bot that forwarded the challenges.
+        full_only (bool, optional): If True, only delete complete batches. Defaults to False.
+        """
+        for chat, usage in self._usage.items():
+            # Challenges past the deletion window can no longer be cleaned up
+            expired = [entry for entry in usage["pending"] if time() - entry[1] >= self.DELETE_WINDOW]
+            if expired:
+                usage["pending"] = [entry for entry in usage["pending"] if entry not in expired]
+                usage["failed"] += len(expired)
+                logger.error(f"{len(expired)} challenge(s) in sink {chat} expired before deletion")
+                self.metrics.set(str(chat), usage)
+            while len(usage["pending"]) >= (self.BATCH_SIZE if full_only else 1):
+                # Take the batch before awaiting, concurrent sweeps share the pending list
+                batch = usage["pending"][:self.BATCH_SIZE]
+                del usage["pending"][:self.BATCH_SIZE]
+                try:
+                    await bot.delete_messages(
+                        chat, [message_id for message_id, _ in batch], rate_limit_args=Priority.BULK
+                    )
+                    usage["deleted"] += len(batch)
+                except telegram.error.BadRequest as error:
+                    usage["failed"] += len(batch)
+                    logger.error(f"Failed to delete {len(batch)} challenge(s) in sink {chat}: {error}")
+                except telegram.error.TelegramError as error:
+                    # Network trouble, keep the batch for the next flush
+                    usage["pending"][:0] = batch
+                    self.metrics.set(str(chat), usage)
+                    logger.warning(f"Deletion of {len(batch)} challenge(s) in sink {chat} postponed: {error}")
+                    break
+                self.metrics.set(str(chat), usage)
+        if not full_only:
+            logger.info(f"Challenge sink usage: {self.usage()}")
+
+    def usage(self) -> Dict[int, dict]:
+        """Usage per sink chat, pending challenges reported as a count."""
+        return {
+            chat: {**usage, "pending": len(usage["pending"])}
+            for chat, usage in self._usage.items()
+        }
+
+# END